@@ -3,14 +3,51 @@ import json
 import re
 import argparse
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from urllib.parse import urlparse, urljoin, urldefrag
-from bs4 import BeautifulSoup
+import aiofiles
+from urllib.parse import (
+    urlparse, urljoin, urlsplit, urlunsplit, parse_qsl, urlencode)
+from selectolax.lexbor import LexborHTMLParser
 from crawl4ai import AsyncWebCrawler
 from crawl4ai.async_configs import BrowserConfig, CrawlerRunConfig, CacheMode
 
 
+class AsyncTokenBucket:
+    """Limits how often an operation may start: rate_per_sec on average, up to burst at once."""
+
+    def __init__(self, rate_per_sec: float, burst: int = 1):
+        self.rate_per_sec = rate_per_sec
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()  # Waiters are served in arrival order
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate_per_sec)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate_per_sec)
+
+
 class PrivateDocumentationCrawler:
+    # Login markers; these normally show up in the <title> or the first few KB of a page
+    _LOGIN_RE = re.compile(r'\b(?:Log ?In|Sign In)\b', re.I)
+    _LOGIN_SCAN_CHARS = 8192
+    # Links to these are assets, not documentation pages, so they are never crawled
+    _SKIP_EXT = frozenset({
+        '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.ico', '.pdf',
+        '.zip', '.tar', '.gz', '.mp3', '.mp4', '.avi', '.mov', '.css', '.js',
+        '.woff', '.woff2', '.ttf', '.eot', '.xml', '.rss'})
+
     def __init__(
         self,
         base_url: str,
@@ -20,12 +57,15 @@ class PrivateDocumentationCrawler:
         resume: bool = True,
         max_workers: int = 5,
         max_depth: int = 0,
-        exclude_pattern: str = None
+        exclude_pattern: str = None,
+        headless: bool = True,
+        requests_per_second: float = 2.0
     ):
-        self.base_url = base_url
+        self.base_url = self._canonicalize_url(base_url)
         self.user_profile_dir = Path(
             user_profile_dir).resolve()  # Ensure absolute path
         self.browser_type = browser_type
+        self.headless = headless  # False opens a visible window, e.g. to log in manually
         self.output_dir = Path(output_dir)
         self.resume = resume
         self.max_workers = max_workers
@@ -35,10 +75,34 @@ class PrivateDocumentationCrawler:
 
         self.visited_urls = set()
         self.queue = {}  # Store URLs with their depth: {url: depth}
+        self.enqueued = set()  # URLs queued or in flight, not yet visited
+        self._in_flight = {}  # {url: depth} of pages being processed, saved as queued
+        self._unsaved_visited = []  # Finished URLs not yet appended to visited.log
         self.lock = asyncio.Lock()
+        self._save_lock = asyncio.Lock()  # Serializes writers of the state file
+        self._dirty_counter = 0  # URLs processed since the last state save
+        self._save_every = 50
+        # Bounds the number of pages fetched concurrently
+        self._sem = asyncio.Semaphore(max_workers)
+        # Paces how often fetches start; 0 or less disables the limit
+        self._limiter = AsyncTokenBucket(
+            requests_per_second, burst=max_workers) if requests_per_second > 0 else None
+        # Runs markdown writes so they overlap with other workers' page fetches
+        self._io_pool = ThreadPoolExecutor(max_workers=max_workers)
         self.state_file = self.output_dir / \
             "crawler_private_state.json"  # Use a different state file
-        self.base_domain = urlparse(base_url).netloc
+        # Append-only log of visited URLs, so saves don't rewrite the whole set. The state
+        # file records the log's size at each save; lines past it are from after the
+        # last queue snapshot and are dropped on resume
+        self.visited_log = self.output_dir / "visited.log"
+        self._visited_fp = None  # Opened for the duration of crawl()
+        self.base_domain = urlparse(self.base_url).netloc
+        # Scheme + host + base path; in-scope URLs are this or start with it plus '/' or '?'
+        self._base_root = self.base_url.rstrip('/')
+        # Markdown links like [text](url); compiled once and reused for every page
+        self._link_pat = re.compile(r'\[(.*?)\]\((https?://[^)]+)\)')
+        self._unsafe_chars = re.compile(r'[<>:"/\\|?*]')
+        self._fname_cache = {}  # {url: filename}, filled by _get_filename
 
         if not self.user_profile_dir.exists() or not self.user_profile_dir.is_dir():
             raise ValueError(
@@ -47,44 +111,94 @@ class PrivateDocumentationCrawler:
         self.output_dir.mkdir(exist_ok=True)
         if self.resume and self.state_file.exists():
             self._load_state()
+        elif self.visited_log.exists():
+            self.visited_log.unlink()  # Left over from an earlier crawl
 
     def _load_state(self):
         try:
             with open(self.state_file, 'r') as f:
                 state = json.load(f)
-                self.visited_urls = set(state.get('visited_urls', []))
-                # Load queue preserving depth
-                loaded_queue = state.get('queue', {})
-                # Filter out already visited URLs from the loaded queue
-                self.queue = {url: depth for url, depth in loaded_queue.items(
-                ) if url not in self.visited_urls}
-                print(
-                    f"Resuming crawl. Loaded {len(self.visited_urls)} visited URLs and {len(self.queue)} URLs in queue.")
+            if self.visited_log.exists():
+                with open(self.visited_log, 'r+b') as f:
+                    # Older state files have no offset; trust the whole log then
+                    offset = state.get('visited_log_offset')
+                    if offset is not None:
+                        f.truncate(offset)
+                    self.visited_urls.update(
+                        line.decode('utf-8').rstrip('\n') for line in f if line.strip())
+            # Older state files still carry the visited URLs themselves. Saves only
+            # write the queue, so move them into the log before they are lost
+            legacy = [url for url in state.get('visited_urls', [])
+                      if url not in self.visited_urls]
+            if legacy:
+                with open(self.visited_log, 'a', encoding='utf-8') as f:
+                    f.writelines(url + '\n' for url in legacy)
+                self.visited_urls.update(legacy)
+            # Load queue preserving depth
+            loaded_queue = state.get('queue', {})
+            # Filter out already visited URLs from the loaded queue
+            self.queue = {url: depth for url, depth in loaded_queue.items(
+            ) if url not in self.visited_urls}
+            self.enqueued = set(self.queue)
+            print(
+                f"Resuming crawl. Loaded {len(self.visited_urls)} visited URLs and {len(self.queue)} URLs in queue.")
         except Exception as e:
             print(f"Error loading state: {e}. Starting fresh.")
             self.visited_urls = set()
             self.queue = {}
+            self.enqueued = set()
 
     async def _save_state(self):
-        async with self.lock:
-            # Only save URLs currently in the queue (not yet processed in this run)
-            state = {
-                'visited_urls': list(self.visited_urls),
-                'queue': self.queue  # Save URLs with depth
-            }
+        # Take the snapshot under _save_lock so an older one never overwrites a newer one
+        async with self._save_lock:
+            async with self.lock:
+                # Queued and in-flight URLs with their depth, plus the pages finished since
+                # the last save; taken together so the log never gets ahead of the queue
+                queue = dict(self.queue)
+                queue.update(self._in_flight)
+                finished, self._unsaved_visited = self._unsaved_visited, []
             try:
-                with open(self.state_file, 'w') as f:
-                    json.dump(state, f, indent=2)
+                # Visited URLs live in visited.log; only the queue is snapshotted
+                if self._visited_fp:
+                    await self._visited_fp.write(''.join(url + '\n' for url in finished))
+                    await self._visited_fp.flush()
+                state = {
+                    'queue': queue,  # Save URLs with depth
+                    'visited_log_offset': (
+                        self.visited_log.stat().st_size if self.visited_log.exists() else 0)
+                }
+                # Encode and write outside self.lock so workers are not blocked on disk I/O
+                payload = json.dumps(state, indent=2)
+                # Write to a temp file and swap it in, so a crash never leaves a truncated state
+                tmp_file = self.state_file.with_suffix('.tmp')
+                async with aiofiles.open(tmp_file, 'w') as f:
+                    await f.write(payload)
+                os.replace(tmp_file, self.state_file)
             except Exception as e:
                 print(f"Error saving state: {e}")
 
+    async def _mark_processed(self):
+        """Counts a processed URL and saves state once every _save_every URLs."""
+        self._dirty_counter += 1
+        if self._dirty_counter >= self._save_every:
+            self._dirty_counter = 0
+            await self._save_state()
+
     def _get_filename(self, url):
+        # The same target is linked from many pages, so reuse earlier results
+        if url in self._fname_cache:
+            return self._fname_cache[url]
+
         # Remove fragment and base url
-        url_no_fragment, _ = urldefrag(url)
-        relative_path = url_no_fragment.replace(self.base_url, '').strip('/')
+        url_no_fragment = url.partition('#')[0]
+        # Queued URLs start with the base URL by construction, so slice it off
+        if url_no_fragment.startswith(self.base_url):
+            relative_path = url_no_fragment[len(self.base_url):].strip('/')
+        else:
+            relative_path = url_no_fragment.replace(self.base_url, '').strip('/')
 
         # Handle potential query parameters by replacing unsafe chars
-        safe_path = re.sub(r'[<>:"/\\|?*]', '_', relative_path)
+        safe_path = self._unsafe_chars.sub('_', relative_path)
 
         if not safe_path:
             safe_path = "index"
@@ -98,6 +212,7 @@ class PrivateDocumentationCrawler:
             else:
                 safe_path = os.path.join(safe_path, "index.md")
 
+        self._fname_cache[url] = safe_path
         return safe_path
 
     def _process_markdown_links(self, markdown, page_url):
@@ -105,6 +220,8 @@ class PrivateDocumentationCrawler:
         # For now, keep it simple or adapt the logic from run.py's DocumentationCrawler
         # This basic version converts absolute links within the base_url domain to relative ones
         page_dir = Path(self._get_filename(page_url)).parent
+        start_dir = self.output_dir / page_dir
+        rel_cache = {}  # {target_filename: path relative to this page}; pages repeat targets
 
         def replacer(match):
             text = match.group(1)
@@ -114,67 +231,93 @@ class PrivateDocumentationCrawler:
             if urlparse(full_link_url).netloc != self.base_domain:
                 return match.group(0)  # Keep external links as they are
 
-            link_no_fragment, fragment = urldefrag(full_link_url)
-            target_filename = self._get_filename(link_no_fragment)
-            target_path = self.output_dir / target_filename
+            link_no_fragment, _, fragment = full_link_url.partition('#')
+            # _get_filename is memoized, so repeated targets cost a dict lookup
+            target_filename = self._get_filename(self._canonicalize_url(link_no_fragment))
 
             try:
-                # Calculate relative path from the current file's directory to the target file
-                relative_link = os.path.relpath(
-                    target_path, start=(self.output_dir / page_dir))
+                relative_link = rel_cache.get(target_filename)
+                if relative_link is None:
+                    # Calculate relative path from the current file's directory to the target file
+                    relative_link = os.path.relpath(
+                        self.output_dir / target_filename, start=start_dir)
+                    rel_cache[target_filename] = relative_link
                 if fragment:
                     relative_link += f"#{fragment}"
                 return f'[{text}]({relative_link})'
             except ValueError:  # Handle cases like different drives on Windows
                 return match.group(0)  # Fallback to original link
 
-        # Regex to find markdown links like [text](url)
-        # Be careful with greedy matching, ensure URL part is captured correctly
-        pattern = r'\[(.*?)\]\((https?://[^\)]+)\)'
-
         try:
-            processed_markdown = re.sub(pattern, replacer, markdown)
+            processed_markdown = self._link_pat.sub(replacer, markdown)
         except Exception as e:
             print(f"Error processing links for {page_url}: {e}")
             processed_markdown = markdown  # Return original on error
 
         return processed_markdown
 
+    @staticmethod
+    def _canonicalize_url(url):
+        """Collapses spellings of the same page into one URL: lowercase scheme and host,
+        no default port, no utm_* parameters, no trailing index.html or slash."""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        netloc = parts.netloc.lower()
+        if (scheme == 'http' and netloc.endswith(':80')) or (
+                scheme == 'https' and netloc.endswith(':443')):
+            netloc = netloc.rsplit(':', 1)[0]
+
+        query = parts.query
+        if 'utm_' in query:
+            query = urlencode([(k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+                               if not k.startswith('utm_')])
+
+        path = parts.path
+        if path.endswith('/index.html'):
+            path = path[:-len('index.html')]
+        if len(path) > 1 and path.endswith('/'):
+            path = path[:-1]
+        return urlunsplit((scheme, netloc, path or '/', query, ''))
+
     def _normalize_url(self, href, base_url):
         """Normalizes a URL found in href, ensuring it's within the base domain and base path."""
-        if not href or href.startswith(('#', 'mailto:', 'tel:', 'javascript:')):
+        if not href or href.startswith(('#', 'mailto:', 'tel:', 'javascript:', 'data:')):
             return None
 
         # Resolve relative URLs
         full_url = urljoin(base_url, href)
+        # Remove fragment and collapse equivalent forms so each page is queued once
+        url_no_fragment = self._canonicalize_url(full_url.partition('#')[0])
 
-        # Check if it's within the same domain
-        if urlparse(full_url).netloc != self.base_domain:
-            return None
-
-        # Check if it starts with the base URL path
-        if not full_url.startswith(self.base_url):
+        # Check it is on the same domain and under the base URL path; a plain prefix
+        # check on the string covers both without parsing the URL again
+        rest = url_no_fragment[len(self._base_root):]
+        if not url_no_fragment.startswith(self._base_root) or rest[:1] not in ('', '/', '?'):
             # Allow links that are on the same domain but outside the specific base path if needed?
             # For strict documentation crawling, usually we want to stay within the base_url path.
             # Modify this check if broader same-domain crawling is desired.
             # print(f"Skipping URL outside base path: {full_url}")
             return None
 
+        # Skip assets; rest (minus any query) is the URL path below the base URL
+        ext = os.path.splitext(rest.partition('?')[0])[1].lower()
+        if ext in self._SKIP_EXT:
+            return None
+
         # Apply exclusion pattern if defined
         if self.exclude_pattern and self.exclude_pattern.search(full_url):
             # print(f"Excluding URL by pattern: {full_url}")
             return None
 
-        # Remove fragment
-        url_no_fragment, _ = urldefrag(full_url)
         return url_no_fragment
 
     async def _extract_links(self, html, page_url):
         """Extracts valid, normalized links from the HTML content."""
-        soup = BeautifulSoup(html, 'html.parser')
+        tree = LexborHTMLParser(html)
         links = set()
-        for link in soup.find_all('a', href=True):
-            normalized_url = self._normalize_url(link['href'], page_url)
+        for link in tree.css('a[href]'):
+            normalized_url = self._normalize_url(
+                link.attributes.get('href'), page_url)
             if normalized_url:
                 links.add(normalized_url)
         return links
@@ -189,9 +332,23 @@ class PrivateDocumentationCrawler:
                 # print(f"Skipping URL due to depth limit ({depth} > {self.max_depth}): {url}")
                 return
             self.visited_urls.add(url)
+            self.enqueued.discard(url)
             # Remove from queue once processing starts
             self.queue.pop(url, None)
+            self._in_flight[url] = depth
 
+        try:
+            await self._crawl_page(url, depth, crawler)
+        finally:
+            # Logged as visited only now, once the links it found are queued
+            async with self.lock:
+                self._in_flight.pop(url, None)
+                self._unsaved_visited.append(url)
+        # Save state periodically rather than after every URL
+        await self._mark_processed()
+
+    async def _crawl_page(self, url, depth, crawler):
+        """Fetches url, saves its markdown and queues the links it finds."""
         print(f"Crawling (Depth {depth}): {url}")
 
         # Define specific run config for this URL
@@ -212,7 +369,10 @@ class PrivateDocumentationCrawler:
         
         for attempt in range(1, max_retries + 1):
             try:
-                result = await crawler.arun(url=url, config=run_config)
+                async with self._sem:
+                    if self._limiter:
+                        await self._limiter.acquire()
+                    result = await crawler.arun(url=url, config=run_config)
                 break  # Success, exit retry loop
             except Exception as e:
                 error_message = str(e)
@@ -227,17 +387,15 @@ class PrivateDocumentationCrawler:
                         async with self.lock:
                             if url in self.queue:
                                 self.queue.pop(url)
-                        await self._save_state()
                         return
                 else:
                     # For other exceptions, log and continue
                     print(f"Error processing {url}: {error_message}")
-                    await self._save_state()
                     return
 
         if result.success and result.markdown:
             # Check if the content is a login page
-            if "Log In" in result.html or "Login" in result.html or "Sign In" in result.html:
+            if self._LOGIN_RE.search(result.html[:self._LOGIN_SCAN_CHARS]):
                 print(f"Detected login page. Skipping: {url}")
                 return
 
@@ -250,19 +408,24 @@ class PrivateDocumentationCrawler:
                 result.markdown, url)
 
             try:
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(processed_markdown)
+                await asyncio.get_running_loop().run_in_executor(
+                    self._io_pool, output_path.write_text, processed_markdown, 'utf-8')
                 print(f"Saved: {output_path}")
             except OSError as e:
                 print(f"Error saving file {output_path}: {e}")
 
             # Extract links only if within depth limit for the *next* level
             if self.max_depth == 0 or depth < self.max_depth:
-                new_urls = await self._extract_links(result.html, url)
+                # Leaf pages at max_depth are never parsed. Resolve relative hrefs against
+                # the URL the browser ended up on; the canonical URL has no trailing
+                # slash, while the server may redirect to one
+                page_url = getattr(result, 'redirected_url', None) or url
+                new_urls = await self._extract_links(result.html, page_url)
                 async with self.lock:
                     for new_url in new_urls:
                         # Add to queue only if not visited and not already queued
-                        if new_url not in self.visited_urls and new_url not in self.queue:
+                        if new_url not in self.visited_urls and new_url not in self.enqueued:
+                            self.enqueued.add(new_url)
                             self.queue[new_url] = depth + 1
                             # print(f"Added to queue (Depth {depth + 1}): {new_url}")
             else:
@@ -280,26 +443,12 @@ class PrivateDocumentationCrawler:
             elif "context" in error_msg.lower() or "browser" in error_msg.lower():
                 print(f"  → Browser context error. The browser session might have been interrupted.")
 
-        # Save state periodically or after processing each URL
-        await self._save_state()
-
-    async def crawl(self):
-        """Main crawling loop."""
-        async with self.lock:
-            if not self.queue and self.base_url not in self.visited_urls:
-                # Start queue with base URL at depth 1
-                # Check if base URL is excluded
-                if self._normalize_url(self.base_url, self.base_url):
-                    self.queue[self.base_url] = 1
-                    print(
-                        f"Initial URL added to queue (Depth 1): {self.base_url}")
-                else:
-                    print(
-                        f"Base URL {self.base_url} is excluded or invalid. Cannot start crawl.")
-                    return
-
-        # Save state periodically or after processing each URL
-        await self._save_state()
+    async def close(self):
+        """Closes the visited log and shuts down the file-writing thread pool."""
+        if self._visited_fp:
+            await self._visited_fp.close()
+            self._visited_fp = None
+        self._io_pool.shutdown(wait=True)
 
     async def crawl(self):
         """Main crawling loop."""
@@ -309,6 +458,7 @@ class PrivateDocumentationCrawler:
                 # Check if base URL is excluded
                 if self._normalize_url(self.base_url, self.base_url):
                     self.queue[self.base_url] = 1
+                    self.enqueued.add(self.base_url)
                     print(
                         f"Initial URL added to queue (Depth 1): {self.base_url}")
                 else:
@@ -318,21 +468,23 @@ class PrivateDocumentationCrawler:
 
         browser_config = BrowserConfig(
             browser_type='chromium',
-            headless=False,
+            headless=self.headless,
             use_persistent_context=True,
             user_data_dir=str(self.user_profile_dir),
             verbose=True
         )
 
+        self._visited_fp = await aiofiles.open(
+            self.visited_log, 'a', encoding='utf-8')
         try:
             async with AsyncWebCrawler(config=browser_config) as crawler:
                 while True:
                     async with self.lock:
                         if not self.queue:
                             break
-                        # Get items respecting max_workers limit
-                        items_to_process = list(self.queue.items())[
-                            :self.max_workers]
+                        # Get items respecting max_workers limit, without copying the whole queue
+                        items_to_process = list(
+                            islice(self.queue.items(), self.max_workers))
 
                         # Prepare batch: list of (url, depth) tuples
                         batch = [(url, depth) for url, depth in items_to_process]
@@ -342,26 +494,23 @@ class PrivateDocumentationCrawler:
                         await asyncio.sleep(1)
                         continue
 
-                    # Process URLs one by one with a small delay to avoid overwhelming the server
-                    for url, depth in batch:
-                        print(f"Processing: {url} (Depth: {depth})")
-                        try:
-                            await self.process_url(url, depth, crawler)
-                        except Exception as e:
-                            print(f"Unexpected error processing {url}: {str(e)}")
-                            # Continue with next URL instead of failing the entire batch
-                            continue
-                        # Small delay between requests
-                        await asyncio.sleep(0.5)
-                    
-                    # Save state after each batch completes
-                    await self._save_state()
+                    # Process the batch concurrently; the semaphore in process_url bounds
+                    # how many pages are fetched at once
+                    results = await asyncio.gather(
+                        *[self.process_url(url, depth, crawler) for url, depth in batch],
+                        return_exceptions=True)
+                    for (url, _), outcome in zip(batch, results):
+                        if isinstance(outcome, Exception):
+                            # Continue with the rest instead of failing the entire batch
+                            print(f"Unexpected error processing {url}: {str(outcome)}")
         except Exception as e:
             print(f"Critical crawler error: {str(e)}")
-            # Save state before exiting due to critical error
+        finally:
+            # Persist progress not yet covered by the periodic saves, including on errors
             await self._save_state()
+            await self.close()
 
-            print("\nCrawl completed!")
+        print("\nCrawl completed!")
 
 
 async def main(args):
@@ -374,7 +523,9 @@ async def main(args):
             resume=not args.noresume,
             max_workers=args.workers,
             max_depth=args.max_depth,
-            exclude_pattern=args.exclude
+            exclude_pattern=args.exclude,
+            headless=args.headless,
+            requests_per_second=args.rps
         )
         await crawler.crawl()
     except ValueError as e:
@@ -412,6 +563,11 @@ if __name__ == "__main__":
         type=int,
         default=5,
         help='Number of concurrent workers')
+    parser.add_argument(
+        '--rps',
+        type=float,
+        default=2.0,
+        help='Maximum number of page fetches started per second (0 for no limit)')
     parser.add_argument(
         '--max-depth',
         type=int,
@@ -422,6 +578,17 @@ if __name__ == "__main__":
         type=str,
         default=None,
         help='Regex pattern for URLs to exclude (e.g., "/api/.*")')
+    parser.add_argument(
+        '--headless',
+        dest='headless',
+        action='store_true',
+        help='Run the browser without a window (default)')
+    parser.add_argument(
+        '--no-headless',
+        dest='headless',
+        action='store_false',
+        help='Open a visible browser window, e.g. to log in manually')
+    parser.set_defaults(headless=True)
 
     args = parser.parse_args()
 
@@ -1,63 +1,220 @@
 import asyncio
+import hashlib
 import json
+import os
 import re
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack, closing
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
 from crawl4ai import AsyncWebCrawler
 from crawl4ai.async_configs import BrowserConfig, CrawlerRunConfig, CacheMode
 from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
+
+try:
+    # Optional: stdlib re only understands possessive quantifiers from Python 3.11
+    import regex as possessive_re
+except ImportError:
+    possessive_re = re
+# Python 3.10's re rejects "*+"; the negated classes in _md_link_pat already keep
+# plain "*" from backtracking far, so the possessive form is only a bonus
+_POSSESSIVE = '+' if possessive_re is not re or sys.version_info >= (3, 11) else ''
 
 
 class DocumentationCrawler:
-    def __init__(self, base_url, output_dir="output", resume=True, max_workers=5):
-        self.base_url = base_url.rstrip('/')
+    # Links to these are assets, not documentation pages, so they are never crawled
+    _SKIP_EXT = frozenset({
+        '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.ico', '.pdf',
+        '.zip', '.tar', '.gz', '.mp3', '.mp4', '.avi', '.mov', '.css', '.js',
+        '.woff', '.woff2', '.ttf', '.eot', '.xml', '.rss'})
+    _SCHEMES = ('http://', 'https://')
+    # Rewrite links with plain str.replace; set False to use the regex-based rewrite
+    fast_link_rewrite = True
+
+    def __init__(self, base_url, output_dir="output", resume=True, max_workers=5,
+                 force_fresh=False, per_host=None):
+        # Interned: compared against every discovered link
+        self.base_url = sys.intern(base_url.rstrip('/'))
         self.output_dir = Path(output_dir)
         self.resume = resume
         self.visited_urls = set()
-        self.queue = []
+        # asyncio.Queue of URLs waiting to be crawled, created and seeded in crawl()
+        self.queue = None
+        # asyncio.Queue of (path, bytes, url, hash) drained by _writer, created in crawl()
+        self._write_queue = None
+        # URLs currently waiting in the queue, for O(1) membership checks
+        self.enqueued = set()
         self.lock = asyncio.Lock()
-        self.state_file = self.output_dir / "crawler_state.json"
-        self.max_workers = max_workers
+        self._dirty_since_save = 0  # Pages processed since the last commit
+        self._save_every = 50
+        # SQLite in WAL mode: pages and new links are single-row inserts, committed
+        # every _save_every pages, instead of rewriting a whole state file
+        self.state_db = self.output_dir / "state.db"
+        self.state_file = self.output_dir / "crawler_state.json"  # Imported from older versions
+        # BLAKE2b of each page's markdown as last written. Kept across fresh crawls
+        # too, so pages whose content is unchanged are not rewritten
+        self.content_hashes = {}  # {url: hash}
+        self._mkdir_cache = set()  # Output directories already created
+        self._fname_cache = {}  # {url: filename}, filled by _get_filename
+        # {(markdown digest, page path): regex-rewritten markdown}, least recently used first.
+        # Only used when fast_link_rewrite is False (it is True by default); hashing a page
+        # costs more than the str.replace rewrite itself
+        self._md_cache = OrderedDict()
+        self._md_cache_size = 256
+        self.max_workers = max_workers  # Number of worker tasks fetching pages concurrently
+        # At most per_host fetches at once to any one host. Every crawled URL is on the
+        # base host, so this only limits anything when set below max_workers
+        self.per_host = per_host or max_workers
+        self._host_sems = {}  # {netloc: asyncio.Semaphore}
+        # Re-fetch every page instead of serving previously crawled ones from crawl4ai's cache
+        self.force_fresh = force_fresh
         self.base_domain = urlparse(base_url).netloc
+        self._base_parsed = urlparse(self.base_url)
+        self._base_url_len = len(self.base_url)
+        self._base_path = self._base_parsed.path or '/'
+        self._base_path_prefix = self._base_path.rstrip('/') + '/'
+        # Possessive quantifiers never backtrack, so stray brackets in long lines
+        # can't make matching blow up
+        self._md_link_pat = possessive_re.compile(
+            rf'\[([^\]]*{_POSSESSIVE})\]\({re.escape(self.base_url)}([^)]*{_POSSESSIVE})\)')
 
-        self.output_dir.mkdir(exist_ok=True)
-        if self.resume and self.state_file.exists():
-            self._load_state()
+        self.browser_config = BrowserConfig(
+            headless=True,
+            viewport_width=650,
+            viewport_height=2000,
+            verbose=False
+        )
 
-    def _load_state(self):
+        self.run_config = CrawlerRunConfig(
+            word_count_threshold=10,
+            exclude_external_links=True,
+            remove_overlay_elements=True,
+            process_iframes=True,
+            cache_mode=CacheMode.BYPASS if self.force_fresh else CacheMode.ENABLED,
+            excluded_tags=["form", "header", "footer"],
+            excluded_selector=".header, .footer, .rm-Header",
+            verbose=False
+        )
+
+        # Browser shared by every crawl() while the crawler is used as a context manager
+        self._crawler = None
+        self._exit_stack = None
+
+        self.output_dir.mkdir(exist_ok=True)
+        self._db = None  # Open for the duration of crawl()
+        self._load_state()
+
+    def _open_state_db(self):
+        new_db = not self.state_db.exists()
+        conn = sqlite3.connect(self.state_db)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # With WAL, NORMAL still never corrupts the database; a crash can at most
+        # lose the commits since the last checkpoint
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS visited (url TEXT PRIMARY KEY)')
+        conn.execute('CREATE TABLE IF NOT EXISTS queue (url TEXT PRIMARY KEY, added_at REAL)')
+        # Separate from visited so that a fresh crawl, which clears visited, keeps them
+        conn.execute('CREATE TABLE IF NOT EXISTS content_hashes (url TEXT PRIMARY KEY, hash TEXT)')
+        if new_db and self.state_file.exists():
+            self._import_json_state(conn)
+        conn.commit()
+        return conn
+
+    def _import_json_state(self, conn):
+        """Carries a crawl saved by older versions in crawler_state.json over into the database."""
         try:
             with open(self.state_file, 'r') as f:
                 state = json.load(f)
-                self.visited_urls = set(state.get('visited_urls', []))
-                self.queue = state.get('queue', [])
+            visited = set(state.get('visited_urls', []))
+            conn.executemany('INSERT OR IGNORE INTO visited (url) VALUES (?)',
+                             ((url,) for url in visited))
+            now = time.time()
+            conn.executemany('INSERT OR IGNORE INTO queue (url, added_at) VALUES (?, ?)',
+                             ((url, now) for url in state.get('queue', []) if url not in visited))
         except Exception as e:
+            print(f"Error importing old state: {e}")
+
+    def _load_state(self):
+        try:
+            with closing(self._open_state_db()) as conn:
+                self.content_hashes = dict(conn.execute('SELECT url, hash FROM content_hashes'))
+                if self.resume:
+                    self.visited_urls = {url for url, in conn.execute('SELECT url FROM visited')}
+                    self.enqueued = {url for url, in conn.execute(
+                        'SELECT url FROM queue')} - self.visited_urls
+                else:
+                    # A fresh crawl starts from nothing but the content hashes
+                    conn.execute('DELETE FROM visited')
+                    conn.execute('DELETE FROM queue')
+                    conn.commit()
+        except sqlite3.Error as e:
             print(f"Error loading state: {e}")
 
-    async def _save_state(self):
-        async with self.lock:
-            state = {
-                'visited_urls': list(self.visited_urls),
-                'queue': self.queue
-            }
-            try:
-                with open(self.state_file, 'w') as f:
-                    json.dump(state, f)
-            except Exception as e:
-                print(f"Error saving state: {e}")
+    def _save_state(self):
+        # Rows are written as pages finish; saving only has to commit them
+        try:
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Error saving state: {e}")
 
     def _get_filename(self, url):
-        url_without_fragment = url.split('#')[0]
-        path = url_without_fragment.replace(self.base_url, '').strip('/')
+        if url in self._fname_cache:
+            return self._fname_cache[url]
+
+        url_without_fragment = url.partition('#')[0]
+        # Queued URLs start with base_url, so the prefix can just be sliced off
+        if url_without_fragment.startswith(self.base_url):
+            path = url_without_fragment[self._base_url_len:].strip('/')
+        else:
+            path = url_without_fragment.replace(self.base_url, '').strip('/')
         if not path:
             path = "index"
-        return f"{path}.md"
-
-    def _process_markdown_links(self, markdown, page_url):
-        base_path = urlparse(page_url).path.rsplit('#', 1)[0]
 
-        pattern = rf'\[(.*?)\]\({self.base_url}(.*?)\)'
+        filename = f"{path}.md"
+        self._fname_cache[url] = filename
+        return filename
 
+    def _process_markdown_links(self, markdown, page_url):
+        if self.base_url not in markdown:
+            return markdown  # Nothing links back into the site
+
+        # Links are matched relative to base_url, so compare against the page path
+        # relative to it too
+        base_path = urlparse(page_url).path
+        if base_path.startswith(self._base_parsed.path):
+            base_path = base_path[len(self._base_parsed.path):]
+
+        if self.fast_link_rewrite:
+            # A few str.replace passes are cheaper than hashing the page for the cache
+            return self._rewrite_links_fast(markdown, base_path)
+
+        # Tag pages and redirect stubs often repeat the same markdown; reuse the
+        # result instead of running the regex again
+        key = (hashlib.blake2b(markdown.encode('utf-8'), digest_size=16).digest(), base_path)
+        processed = self._md_cache.get(key)
+        if processed is not None:
+            self._md_cache.move_to_end(key)
+            return processed
+
+        processed = self._rewrite_links_regex(markdown, base_path)
+        self._md_cache[key] = processed
+        if len(self._md_cache) > self._md_cache_size:
+            self._md_cache.popitem(last=False)
+        return processed
+
+    def _rewrite_links_fast(self, markdown, base_path):
+        prefix = f']({self.base_url}'
+        # Anchors on this page (or the site root link) become plain fragments...
+        markdown = markdown.replace(f'{prefix}#', '](#')
+        if base_path:
+            markdown = markdown.replace(f'{prefix}{base_path}#', '](#')
+        # ...and every other link into the site becomes relative
+        return markdown.replace(f'{prefix}/', '](./').replace(f'{prefix})', '](.)')
+
+    def _rewrite_links_regex(self, markdown, base_path):
         def replacer(match):
             text = match.group(1)
             link = match.group(2)
@@ -69,25 +226,15 @@ class DocumentationCrawler:
                     return f'[{text}](#{fragment})'
             return f'[{text}](.{link})'
 
-        return re.sub(pattern, replacer, markdown)
+        return self._md_link_pat.sub(replacer, markdown)
 
     async def _extract_links(self, html, base_url):
-        soup = BeautifulSoup(html, 'html.parser')
+        tree = LexborHTMLParser(html)
         links = set()
 
-        # Find all navigation links
-        nav_links = soup.select('nav a, aside a, .sidebar a, .menu a')
-        for link in nav_links:
-            href = link.get('href')
-            if href:
-                full_url = self._normalize_url(href, base_url)
-                if full_url:
-                    links.add(full_url)
-
-        # Find all content links
-        content_links = soup.select('a')
-        for link in content_links:
-            href = link.get('href')
+        # Every anchor on the page, which covers navigation and content links
+        for link in tree.css('a[href]'):
+            href = link.attributes.get('href')
             if href:
                 full_url = self._normalize_url(href, base_url)
                 if full_url:
@@ -95,100 +242,209 @@ class DocumentationCrawler:
 
         return links
 
+    def _in_scope(self, parsed):
+        """Whether a parsed URL is on the base host and under the base path."""
+        if parsed.netloc != self.base_domain or parsed.scheme != self._base_parsed.scheme:
+            return False
+        # Compare whole path segments, so /docs does not match /docs-old
+        path = parsed.path or '/'  # "https://host" and "?q=1" are the site root
+        return path == self._base_path or path.startswith(self._base_path_prefix)
+
     def _normalize_url(self, href, base_url):
-        if href.startswith(('http://', 'https://')):
-            if urlparse(href).netloc != self.base_domain:
-                return None
-            return href.split('#')[0]
-
-        # Handle relative URLs
-        full_url = urljoin(base_url, href)
-        if not full_url.startswith(self.base_url):
+        # One pass per link: resolve, drop the fragment, then parse once
+        is_absolute = href.startswith(self._SCHEMES)
+        full_url = (href if is_absolute else urljoin(base_url, href)).partition('#')[0]
+
+        parts = urlparse(full_url)
+        if not self._in_scope(parts):
+            return None
+
+        # Skip images, downloads and other assets
+        if os.path.splitext(parts.path)[1].lower() in self._SKIP_EXT:
             return None
 
-        return full_url.split('#')[0]
+        return full_url
+
+    def _host_sem(self, url):
+        netloc = urlparse(url).netloc
+        sem = self._host_sems.get(netloc)
+        if sem is None:
+            sem = self._host_sems[netloc] = asyncio.Semaphore(self.per_host)
+        return sem
 
     async def process_url(self, url, crawler):
         async with self.lock:
             if url in self.visited_urls:
                 return
             self.visited_urls.add(url.split('#')[0])
+            self.enqueued.discard(url)
 
         print(f"\nCrawling: {url}")
 
-        result = await crawler.arun(url=url, config=self.run_config)
+        async with self._host_sem(url):
+            result = await crawler.arun(url=url, config=self.run_config)
 
         if result.success:
             filename = self._get_filename(url)
             output_path = self.output_dir / filename
-            output_path.parent.mkdir(parents=True, exist_ok=True)
+            if output_path.parent not in self._mkdir_cache:
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                self._mkdir_cache.add(output_path.parent)
 
             processed_markdown = self._process_markdown_links(
                 result.markdown, url)
 
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(processed_markdown)
-
-            print(f"Saved: {output_path}")
+            data = processed_markdown.encode('utf-8')
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            if self.content_hashes.get(url) == digest and output_path.exists():
+                print(f"Unchanged: {output_path}")
+            else:
+                # Hand the encoded page to the writer task and go on with the next fetch
+                await self._write_queue.put((output_path, data, url, digest))
 
             # Extract links from both navigation and content
             new_urls = await self._extract_links(result.html, url)
 
             async with self.lock:
-                for new_url in new_urls:
-                    if new_url not in self.visited_urls and new_url not in self.queue:
-                        self.queue.append(new_url)
-                        print(f"Added to queue: {new_url}")
-
-        await self._save_state()
+                # Filter the whole page's links in one pass, then register them together
+                accepted = [u for u in new_urls
+                            if u not in self.visited_urls and u not in self.enqueued]
+                self.enqueued.update(accepted)
+            now = time.time()
+            self._db.executemany('INSERT OR IGNORE INTO queue (url, added_at) VALUES (?, ?)',
+                                 ((new_url, now) for new_url in accepted))
+            # asyncio.Queue has no batch put; put_nowait never blocks on an unbounded queue
+            for new_url in accepted:
+                self.queue.put_nowait(new_url)
+                print(f"Added to queue: {new_url}")
+
+        # Recorded once the page is done, so a crash mid-fetch leaves it queued for resume
+        self._db.execute('INSERT OR IGNORE INTO visited (url) VALUES (?)',
+                         (url.split('#')[0],))
+        self._db.execute('DELETE FROM queue WHERE url = ?', (url,))
+
+        # Commit every _save_every pages rather than after each one
+        self._dirty_since_save += 1
+        if self._dirty_since_save >= self._save_every:
+            self._dirty_since_save = 0
+            self._save_state()
+
+    async def _worker(self, crawler):
+        while True:
+            url = await self.queue.get()
+            try:
+                await self.process_url(url, crawler)
+            except Exception as e:
+                print(f"Error processing {url}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def __aenter__(self):
+        # One long-lived browser keeps its connections to the site alive between
+        # pages and between crawl() calls, instead of reconnecting each time
+        self._exit_stack = AsyncExitStack()
+        self._crawler = await self._exit_stack.enter_async_context(
+            AsyncWebCrawler(config=self.browser_config))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._exit_stack.aclose()
+        self._crawler = None
+        self._exit_stack = None
+
+    @staticmethod
+    def _write_file(path, data):
+        # Write to a temp file and swap it in, so a failed write never leaves a truncated page
+        tmp_path = path.with_name(path.name + '.tmp')
+        try:
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    async def _writer(self):
+        while True:
+            path, data, url, digest = await self._write_queue.get()
+            try:
+                await asyncio.to_thread(self._write_file, path, data)
+                # Only a fully written page may later be skipped as unchanged
+                self.content_hashes[url] = digest
+                self._db.execute('INSERT OR REPLACE INTO content_hashes (url, hash) VALUES (?, ?)',
+                                 (url, digest))
+                print(f"Saved: {path}")
+            except OSError as e:
+                print(f"Error saving file {path}: {e}")
+            except Exception as e:
+                # E.g. sqlite3.Error recording the hash; keep draining the queue
+                print(f"Error recording {url}: {e}")
+            finally:
+                self._write_queue.task_done()
 
     async def crawl(self):
-        if not self.queue and self.base_url not in self.visited_urls:
-            self.queue.append(self.base_url)
+        if self._crawler is None:
+            # Not inside "async with": open a browser just for this crawl
+            async with self:
+                return await self.crawl()
+        crawler = self._crawler
+
+        # Created here so the queues belong to the running event loop
+        self.queue = asyncio.Queue()
+        self._write_queue = asyncio.Queue()
+        self._db = self._open_state_db()
+        for url in self.enqueued:
+            self.queue.put_nowait(url)
+
+        if self.queue.empty() and self.base_url not in self.visited_urls:
+            self.queue.put_nowait(self.base_url)
+            self.enqueued.add(self.base_url)
+            self._db.execute('INSERT OR IGNORE INTO queue (url, added_at) VALUES (?, ?)',
+                             (self.base_url, time.time()))
             print(f"Initial URL added to queue: {self.base_url}")
 
-        self.browser_config = BrowserConfig(
-            headless=True,
-            viewport_width=650,
-            viewport_height=2000,
-            verbose=False
-        )
-
-        self.run_config = CrawlerRunConfig(
-            word_count_threshold=10,
-            exclude_external_links=True,
-            remove_overlay_elements=True,
-            process_iframes=True,
-            cache_mode=CacheMode.DISABLED,
-            excluded_tags=["form", "header", "footer"],
-            excluded_selector=".header, .footer, .rm-Header",
-            verbose=False
-        )
-
-        async with AsyncWebCrawler(config=self.browser_config) as crawler:
-            while True:
-                async with self.lock:
-                    if not self.queue:
-                        break
-                    batch = []
-                    for _ in range(min(self.max_workers, len(self.queue))):
-                        if self.queue:
-                            batch.append(self.queue.pop(0))
-
-                tasks = [self.process_url(url, crawler) for url in batch]
-                await asyncio.gather(*tasks)
+        writer = asyncio.create_task(self._writer())
+        # Each worker picks the next URL as soon as it is free, instead of
+        # waiting for the slowest page of a fixed batch
+        workers = [asyncio.create_task(self._worker(crawler))
+                   for _ in range(self.max_workers)]
+        try:
+            # Pages enqueue their links before being marked done, so this returns
+            # only once the queue is drained and no page is in flight
+            await self.queue.join()
 
             print("\nCrawl completed successfully!")
-
-
-async def main(base_url, noresume=False, workers=5):
-    crawler = DocumentationCrawler(
-        base_url, resume=not noresume, max_workers=workers)
-    await crawler.crawl()
+        finally:
+            # Stop the workers first, also when interrupted, so no page is still
+            # being processed while the writes drain and the state is committed
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Let pending page writes land before the final state save, unless the
+            # writer has died and nothing will drain the queue any more
+            drained = asyncio.ensure_future(self._write_queue.join())
+            await asyncio.wait({drained, writer}, return_when=asyncio.FIRST_COMPLETED)
+            drained.cancel()
+            writer.cancel()
+            # Commit progress since the last checkpoint, also when the crawl is interrupted
+            self._save_state()
+            self._db.close()
+            self._db = None
+
+
+async def main(base_url, noresume=False, workers=5, force_fresh=False, per_host=None):
+    async with DocumentationCrawler(
+            base_url, resume=not noresume, max_workers=workers,
+            force_fresh=force_fresh, per_host=per_host) as crawler:
+        await crawler.crawl()
 
 if __name__ == "__main__":
     import argparse
 
+    try:
+        import uvloop  # Optional: libuv-based event loop with cheaper I/O scheduling
+    except ImportError:
+        uvloop = None
+
     parser = argparse.ArgumentParser(
         description='Crawl documentation website and save pages as markdown files.')
     parser.add_argument(
@@ -197,7 +453,13 @@ if __name__ == "__main__":
                         help='Do not resume from previous crawl')
     parser.add_argument('--workers', type=int, default=5,
                         help='Number of concurrent workers')
+    parser.add_argument('--per-host', type=int, default=None,
+                        help='Maximum concurrent fetches from a single host (default: --workers)')
+    parser.add_argument('--force-fresh', action='store_true',
+                        help='Bypass the crawl4ai cache and re-fetch every page')
 
     args = parser.parse_args()
 
-    asyncio.run(main(args.url, args.noresume, args.workers))
+    run_loop = uvloop.run if uvloop else asyncio.run
+    run_loop(main(args.url, args.noresume, args.workers, args.force_fresh,
+                  args.per_host))
@@ -0,0 +1,58 @@
+"""Loads run.py and run-private.py as modules for the tests.
+
+The scripts are not importable by name (run-private.py has a dash), so they are
+loaded from their paths. crawl4ai is replaced by a minimal stub when it is not
+installed; no test starts a browser.
+"""
+import enum
+import importlib.util
+import sys
+import types
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _install_crawl4ai_stub():
+    class AsyncWebCrawler:
+        def __init__(self, config=None):
+            self.config = config
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            pass
+
+    class _Config:
+        def __init__(self, **kwargs):
+            self.__dict__.update(kwargs)
+
+    crawl4ai = types.ModuleType('crawl4ai')
+    crawl4ai.AsyncWebCrawler = AsyncWebCrawler
+    async_configs = types.ModuleType('crawl4ai.async_configs')
+    async_configs.BrowserConfig = type('BrowserConfig', (_Config,), {})
+    async_configs.CrawlerRunConfig = type('CrawlerRunConfig', (_Config,), {})
+    async_configs.CacheMode = enum.Enum('CacheMode', 'ENABLED DISABLED BYPASS')
+    crawl4ai.async_configs = async_configs
+    sys.modules['crawl4ai'] = crawl4ai
+    sys.modules['crawl4ai.async_configs'] = async_configs
+
+
+def load_script(filename):
+    """Returns the script at the repository root as a module, skipping the tests
+    when its other dependencies (selectolax, aiofiles) are not installed."""
+    try:
+        import crawl4ai  # noqa: F401
+    except ImportError:
+        _install_crawl4ai_stub()
+
+    spec = importlib.util.spec_from_file_location(
+        Path(filename).stem.replace('-', '_'), ROOT / filename)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError as e:
+        raise unittest.SkipTest(f"{filename} dependencies not installed: {e}")
+    return module
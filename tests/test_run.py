@@ -0,0 +1,191 @@
+import asyncio
+import json
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import urlparse
+
+from tests._loader import load_script
+
+
+def setUpModule():
+    global run
+    run = load_script('run.py')
+
+
+class CrawlerTestCase(unittest.TestCase):
+    base_url = 'https://docs.example.com/docs'
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.output_dir = Path(tmp.name)
+
+    def make_crawler(self, base_url=None, **kwargs):
+        return run.DocumentationCrawler(
+            base_url or self.base_url, output_dir=str(self.output_dir), **kwargs)
+
+
+class InScopeTest(CrawlerTestCase):
+    def in_scope(self, crawler, url):
+        return crawler._in_scope(urlparse(url))
+
+    def test_base_path_and_below(self):
+        crawler = self.make_crawler()
+        for url in ('https://docs.example.com/docs', 'https://docs.example.com/docs/',
+                    'https://docs.example.com/docs/guide/intro'):
+            self.assertTrue(self.in_scope(crawler, url), url)
+
+    def test_look_alike_urls(self):
+        crawler = self.make_crawler()
+        for url in ('https://docs.example.com/docs-old/page',  # Same prefix, other segment
+                    'https://docs.example.com.evil.com/docs',  # Host prefix
+                    'https://other.com/docs',
+                    'http://docs.example.com/docs',  # Other scheme
+                    'https://docs.example.com/',
+                    'https://docs.example.com'):
+            self.assertFalse(self.in_scope(crawler, url), url)
+
+    def test_root_base_url(self):
+        crawler = self.make_crawler('https://example.com')
+        for url in ('https://example.com', 'https://example.com/', 'https://example.com?q=1',
+                    'https://example.com/any/page'):
+            self.assertTrue(self.in_scope(crawler, url), url)
+        self.assertFalse(self.in_scope(crawler, 'https://example.com.evil.com/'))
+
+
+class NormalizeUrlTest(CrawlerTestCase):
+    page_url = 'https://docs.example.com/docs/guide'
+
+    def test_spellings_of_the_same_page(self):
+        crawler = self.make_crawler()
+        for href in ('intro', './intro', '/docs/intro', '/docs/intro#setup',
+                     'https://docs.example.com/docs/intro',
+                     'https://docs.example.com/docs/intro#setup'):
+            self.assertEqual(crawler._normalize_url(href, self.page_url),
+                             'https://docs.example.com/docs/intro', href)
+
+    def test_rejected_links(self):
+        crawler = self.make_crawler()
+        for href in ('/docs-old/intro', 'https://other.com/docs/intro', '/blog',
+                     '/docs/logo.PNG', '/docs/style.css', 'mailto:team@example.com'):
+            self.assertIsNone(crawler._normalize_url(href, self.page_url), href)
+
+
+class LinkRewriteTest(CrawlerTestCase):
+    page_url = 'https://docs.example.com/docs/guide'
+    markdown = ('[intro](https://docs.example.com/docs/intro) '
+                '[here](https://docs.example.com/docs/guide#setup) '
+                '[top](https://docs.example.com/docs#top) '
+                '[home](https://docs.example.com/docs) '
+                '[other](https://other.com/docs/x)')
+    expected = '[intro](./intro) [here](#setup) [top](#top) [home](.) [other](https://other.com/docs/x)'
+
+    def test_fast_and_regex_rewrites_agree(self):
+        crawler = self.make_crawler()
+        self.assertEqual(crawler._process_markdown_links(self.markdown, self.page_url),
+                         self.expected)
+        crawler.fast_link_rewrite = False
+        self.assertEqual(crawler._process_markdown_links(self.markdown, self.page_url),
+                         self.expected)
+
+    def test_regex_rewrite_is_cached(self):
+        crawler = self.make_crawler()
+        crawler.fast_link_rewrite = False
+        crawler._md_cache_size = 1
+        with mock.patch.object(crawler, '_rewrite_links_regex',
+                               wraps=crawler._rewrite_links_regex) as rewrite:
+            for _ in range(3):
+                crawler._process_markdown_links(self.markdown, self.page_url)
+            crawler._process_markdown_links(self.markdown + ' ', self.page_url)
+        self.assertEqual(rewrite.call_count, 2)
+        self.assertEqual(len(crawler._md_cache), 1)
+
+    def test_fast_rewrite_skips_the_cache(self):
+        crawler = self.make_crawler()
+        crawler._process_markdown_links(self.markdown, self.page_url)
+        self.assertEqual(len(crawler._md_cache), 0)
+
+
+class StateTest(CrawlerTestCase):
+    def write_legacy_state(self, visited, queue):
+        (self.output_dir / 'crawler_state.json').write_text(
+            json.dumps({'visited_urls': visited, 'queue': queue}))
+
+    def test_resume_from_legacy_json_state(self):
+        docs = self.base_url
+        self.write_legacy_state([docs, docs + '/a'], [docs + '/a', docs + '/b'])
+
+        crawler = self.make_crawler()
+        self.assertEqual(crawler.visited_urls, {docs, docs + '/a'})
+        self.assertEqual(crawler.enqueued, {docs + '/b'})
+
+        # The import lands in state.db, so it survives later runs too
+        crawler = self.make_crawler()
+        self.assertEqual(crawler.visited_urls, {docs, docs + '/a'})
+        self.assertEqual(crawler.enqueued, {docs + '/b'})
+
+    def test_fresh_crawl_keeps_content_hashes(self):
+        docs = self.base_url
+        self.write_legacy_state([docs], [])
+        crawler = self.make_crawler()
+        with run.closing(crawler._open_state_db()) as conn:
+            conn.execute('INSERT INTO content_hashes (url, hash) VALUES (?, ?)', (docs, 'abc'))
+            conn.commit()
+
+        crawler = self.make_crawler(resume=False)
+        self.assertEqual(crawler.visited_urls, set())
+        self.assertEqual(crawler.content_hashes, {docs: 'abc'})
+
+
+
+class FakeCrawler:
+    """Serves a base page linking to two others, without a browser."""
+
+    def __init__(self, config=None):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def arun(self, url, config=None):
+        html = '<a href="/docs/a">A</a><a href="/docs/b">B</a>'
+        if url.endswith(('/a', '/b')):
+            html = ''
+        return SimpleNamespace(success=True, html=html, markdown=f'# {url}')
+
+
+class CrawlTest(CrawlerTestCase):
+    def test_crawl_finishes_when_recording_hashes_fails(self):
+        class FullDiskConnection:
+            def __init__(self, conn):
+                self.conn = conn
+
+            def execute(self, sql, *args):
+                if sql.startswith('INSERT OR REPLACE INTO content_hashes'):
+                    raise sqlite3.OperationalError('database or disk is full')
+                return self.conn.execute(sql, *args)
+
+            def __getattr__(self, name):
+                return getattr(self.conn, name)
+
+        crawler = self.make_crawler()
+        open_state_db = crawler._open_state_db
+        with mock.patch.object(run, 'AsyncWebCrawler', FakeCrawler), \
+                mock.patch.object(crawler, '_open_state_db',
+                                  lambda: FullDiskConnection(open_state_db())):
+            asyncio.run(asyncio.wait_for(crawler.crawl(), 5))
+
+        for name in ('index.md', 'a.md', 'b.md'):
+            self.assertTrue((self.output_dir / name).exists(), name)
+        self.assertIsNone(crawler._db)  # The finally block ran to the end
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import shutil
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from tests._loader import load_script
+
+
+def setUpModule():
+    global run_private
+    run_private = load_script('run-private.py')
+
+
+class CanonicalizeUrlTest(unittest.TestCase):
+    def canonicalize(self, url):
+        return run_private.PrivateDocumentationCrawler._canonicalize_url(url)
+
+    def test_spellings_of_the_same_page(self):
+        for url in ('https://docs.example.com/guide',
+                    'https://docs.example.com/guide/',
+                    'https://docs.example.com/guide/index.html',
+                    'HTTPS://Docs.Example.COM/guide',
+                    'https://docs.example.com:443/guide',
+                    'https://docs.example.com/guide#section',
+                    'https://docs.example.com/guide?utm_source=news&utm_medium=mail'):
+            self.assertEqual(self.canonicalize(url), 'https://docs.example.com/guide', url)
+
+    def test_root(self):
+        for url in ('https://docs.example.com', 'https://docs.example.com/',
+                    'https://docs.example.com/index.html', 'http://docs.example.com:80/'):
+            self.assertEqual(self.canonicalize(url).split('://')[1], 'docs.example.com/', url)
+
+    def test_significant_parts_are_kept(self):
+        self.assertEqual(self.canonicalize('https://docs.example.com/guide?page=2&utm_term=x'),
+                         'https://docs.example.com/guide?page=2')
+        self.assertEqual(self.canonicalize('https://docs.example.com:8443/guide'),
+                         'https://docs.example.com:8443/guide')
+        # Paths are case-sensitive on most servers
+        self.assertEqual(self.canonicalize('https://docs.example.com/Guide'),
+                         'https://docs.example.com/Guide')
+
+
+class CrawlerTestCase(unittest.TestCase):
+    base_url = 'https://docs.example.com/docs'
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.output_dir = Path(tmp.name) / 'output'
+        self.profile_dir = Path(tmp.name) / 'profile'
+        self.profile_dir.mkdir()
+
+    def make_crawler(self, base_url=None, **kwargs):
+        crawler = run_private.PrivateDocumentationCrawler(
+            base_url or self.base_url, str(self.profile_dir),
+            output_dir=str(self.output_dir), **kwargs)
+        self.addCleanup(crawler._io_pool.shutdown)
+        return crawler
+
+
+class NormalizeUrlTest(CrawlerTestCase):
+    page_url = 'https://docs.example.com/docs/guide'
+
+    def test_spellings_of_the_same_page(self):
+        crawler = self.make_crawler()
+        for href in ('intro', './intro', '/docs/intro', '/docs/intro/', '/docs/intro#setup',
+                     '/docs/intro/index.html', '/docs/intro?utm_source=nav',
+                     'https://DOCS.example.com:443/docs/intro'):
+            self.assertEqual(crawler._normalize_url(href, self.page_url),
+                             'https://docs.example.com/docs/intro', href)
+
+    def test_rejected_links(self):
+        crawler = self.make_crawler()
+        for href in (None, '', '#top', 'mailto:team@example.com', 'javascript:void(0)',
+                     '/docs-old/intro', 'https://docs.example.com.evil.com/docs/intro',
+                     'https://other.com/docs/intro', '/blog', '/docs/logo.PNG'):
+            self.assertIsNone(crawler._normalize_url(href, self.page_url), href)
+
+    def test_exclude_pattern(self):
+        crawler = self.make_crawler(exclude_pattern=r'/changelog')
+        self.assertIsNone(crawler._normalize_url('/docs/changelog/v2', self.page_url))
+        self.assertIsNotNone(crawler._normalize_url('/docs/intro', self.page_url))
+
+    def test_root_base_url(self):
+        crawler = self.make_crawler('https://example.com')
+        self.assertEqual(crawler._normalize_url('?q=1', 'https://example.com/'),
+                         'https://example.com/?q=1')
+        self.assertEqual(crawler._normalize_url('/any/page', 'https://example.com/'),
+                         'https://example.com/any/page')
+        self.assertIsNone(crawler._normalize_url('https://example.com.evil.com/', 'https://example.com/'))
+
+
+class DepthLimitTest(CrawlerTestCase):
+    def test_pages_at_max_depth_are_not_parsed(self):
+        class FakeCrawler:
+            def __init__(self, config=None):
+                pass
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc_info):
+                pass
+
+            async def arun(self, url, config=None):
+                return SimpleNamespace(success=True, html='<a href="/docs/a">A</a>',
+                                       markdown='page', error_message=None, redirected_url=url)
+
+        crawler = self.make_crawler(max_depth=1, requests_per_second=0)
+        with mock.patch.object(run_private, 'AsyncWebCrawler', FakeCrawler), \
+                mock.patch.object(crawler, '_extract_links', mock.AsyncMock()) as extract:
+            asyncio.run(crawler.crawl())
+        extract.assert_not_called()
+        self.assertTrue((self.output_dir / 'index' / 'index.md').exists())
+
+
+class StateTest(CrawlerTestCase):
+    def test_resume_from_legacy_state_survives_a_save(self):
+        docs = self.base_url
+        self.output_dir.mkdir()
+        (self.output_dir / 'crawler_private_state.json').write_text(json.dumps({
+            'visited_urls': [docs, docs + '/a'],
+            'queue': {docs + '/a': 2, docs + '/b': 2},
+        }))
+
+        crawler = self.make_crawler()
+        self.assertEqual(crawler.visited_urls, {docs, docs + '/a'})
+        self.assertEqual(crawler.queue, {docs + '/b': 2})
+        # Saves only write the queue; the visited URLs must not be lost with it
+        asyncio.run(crawler._save_state())
+
+        crawler = self.make_crawler()
+        self.assertEqual(crawler.visited_urls, {docs, docs + '/a'})
+        self.assertEqual(crawler.queue, {docs + '/b': 2})
+
+    def test_resume_after_hard_crash_reaches_every_page(self):
+        docs = self.base_url
+        pages = [docs] + [f'{docs}/p{i}' for i in range(1, 120)]
+        output_dir = self.output_dir
+        crash_dir = self.output_dir.parent / 'crashed'
+        fetched = []
+
+        class FakeCrawler:
+            # Each page links to the next two, so the queue keeps a front of pending pages
+            def __init__(self, config=None):
+                pass
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc_info):
+                pass
+
+            async def arun(self, url, config=None):
+                fetched.append(url)
+                if len(fetched) == 80 and not crash_dir.exists():
+                    # A kill -9 leaves whatever reached the OS. Flush the log buffer
+                    # too, the worst case, and keep a copy of the files as they are now
+                    if crawler._visited_fp:
+                        await crawler._visited_fp.flush()
+                    crash_dir.mkdir()
+                    for name in ('visited.log', 'crawler_private_state.json'):
+                        if (output_dir / name).exists():
+                            shutil.copy(output_dir / name, crash_dir / name)
+                i = pages.index(url)
+                html = ''.join(f'<a href="{page}">next</a>' for page in pages[i + 1:i + 3])
+                return SimpleNamespace(success=True, html=html, markdown='page',
+                                       error_message=None, redirected_url=url)
+
+        with mock.patch.object(run_private, 'AsyncWebCrawler', FakeCrawler):
+            crawler = self.make_crawler(requests_per_second=0)
+            asyncio.run(crawler.crawl())
+            crashed_fetches = set(fetched[:80])
+
+            fetched.clear()
+            crawler = run_private.PrivateDocumentationCrawler(
+                docs, str(self.profile_dir), output_dir=str(crash_dir), requests_per_second=0)
+            self.addCleanup(crawler._io_pool.shutdown)
+            asyncio.run(crawler.crawl())
+
+        self.assertEqual(crashed_fetches | set(fetched), set(pages))
+
+    def test_noresume_clears_visited_log(self):
+        self.output_dir.mkdir()
+        (self.output_dir / 'visited.log').write_text(self.base_url + '\n')
+        crawler = self.make_crawler(resume=False)
+        self.assertEqual(crawler.visited_urls, set())
+        self.assertFalse(crawler.visited_log.exists())
+
+
+class AsyncTokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        async def acquire_times(bucket, n):
+            start = time.monotonic()
+            times = []
+            for _ in range(n):
+                await bucket.acquire()
+                times.append(time.monotonic() - start)
+            return times
+
+        bucket = run_private.AsyncTokenBucket(rate_per_sec=20, burst=2)
+        times = asyncio.run(acquire_times(bucket, 4))
+        # The first two start at once, the rest are spaced 1/rate apart
+        self.assertLess(times[1], 0.02)
+        self.assertGreaterEqual(times[2], 0.04)
+        self.assertGreaterEqual(times[3] - times[2], 0.04)
+
+    def test_burst_is_at_least_one(self):
+        self.assertEqual(run_private.AsyncTokenBucket(5, burst=0).burst, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()